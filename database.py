@@ -1,7 +1,19 @@
-import pymongo
+from motor.motor_asyncio import AsyncIOMotorClient
+from config import MONGODB_URL, DATABASE_NAME, MONGODB_MAX_POOL_SIZE, MONGODB_MIN_POOL_SIZE
 
-client = pymongo.MongoClient("mongodb://localhost:27017/")
-db = client["school_payment_system"]
+# Pool limits are per process: with uvicorn/gunicorn running N workers the server
+# sees up to N * maxPoolSize connections, so size maxPoolSize to the concurrent
+# requests a single worker is expected to have in flight. minPoolSize keeps a few
+# connections warm so the first request after an idle period skips the connect.
+client = AsyncIOMotorClient(
+    MONGODB_URL,
+    maxPoolSize=MONGODB_MAX_POOL_SIZE,
+    minPoolSize=MONGODB_MIN_POOL_SIZE,
+    waitQueueTimeoutMS=2000,
+    serverSelectionTimeoutMS=2000,
+    retryWrites=True
+)
+db = client[DATABASE_NAME]
 students_collection = db["students"]
 vendors_collection = db["vendors"]
 transactions_collection = db["transactions"]
@@ -1,23 +1,48 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Request, Response, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 import razorpay
-from database import students_collection, vendors_collection, transactions_collection
-from models import PaymentRequest, WalletRechargeRequest, VerifyPayment, StudentPaymentRequest, StudentQRData
-from config import RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET
-import qrcode
+from database import client as mongo_client, students_collection, vendors_collection, transactions_collection
+from models import APIModel, PaymentRequest, WalletRechargeRequest, VerifyPayment, StudentPaymentRequest, StudentQRData
+from config import RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET, LOG_LEVEL, MONGODB_TRANSACTIONS
+import segno
 from io import BytesIO
 import base64
-import json
+import re
+import orjson
 from bson import ObjectId
+from pymongo import ReturnDocument
 import datetime
 import os
 import hmac
 import hashlib
+import logging
+import asyncio
+from contextlib import asynccontextmanager
+from utils.logging_utils import setup_logging, teardown_logging
 from utils.sms_utils import send_payment_notification, verify_otp, format_recharge_message, format_purchase_message
 from pydantic import BaseModel
 from typing import Optional
+from cachetools import LRUCache, TTLCache
+
+logger = logging.getLogger("cards")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    setup_logging(LOG_LEVEL)
+    # Ensure the lookup and listing queries below are served by indexes
+    await asyncio.gather(
+        students_collection.create_index("student_id", unique=True),
+        vendors_collection.create_index("vendor_id", unique=True),
+        transactions_collection.create_index("order_id"),
+        transactions_collection.create_index([("student_id", 1), ("_id", -1)]),
+        transactions_collection.create_index([("vendor_id", 1), ("_id", -1)])
+    )
+    yield
+    # Flush any queued log records and detach the queue handler
+    teardown_logging()
 
-app = FastAPI(title="Smart Card Payment System")
+app = FastAPI(title="Smart Card Payment System", default_response_class=ORJSONResponse, lifespan=lifespan)
 
 # Configure CORS
 origins = [
@@ -43,9 +68,55 @@ class Parent(BaseModel):
     phone: Optional[str] = None
     name: Optional[str] = None
 
-async def get_parent_by_student_id(student_id: str) -> Optional[Parent]:
-    """Get parent information from student record"""
-    student = students_collection.find_one({"student_id": student_id})
+_DATE_FORMAT = "%d/%m/%Y, %H:%M:%S"
+
+def _stamp() -> tuple[datetime.datetime, str]:
+    """Current time plus its display string, taken from a single clock read"""
+    now = datetime.datetime.now()
+    return now, now.strftime(_DATE_FORMAT)
+
+STUDENT_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+# Short-lived caches for student/vendor identity fields (names and UPI IDs). Workers
+# don't share these caches, so anything that can change at runtime (balances, parent
+# contact details) is always read from Mongo.
+student_cache = TTLCache(maxsize=10_000, ttl=60)
+vendor_cache = TTLCache(maxsize=10_000, ttl=60)
+
+async def get_cached_student(student_id: str) -> Optional[dict]:
+    """Get a student's name, served from the TTL cache when possible"""
+    student = student_cache.get(student_id)
+    if student is None:
+        student = await students_collection.find_one(
+            {"student_id": student_id},
+            {"_id": 0, "student_id": 1, "name": 1}
+        )
+        if student is not None:
+            student_cache[student_id] = student
+    return student
+
+async def get_cached_vendor(vendor_id: str) -> Optional[dict]:
+    """Get a vendor's name and UPI ID, served from the TTL cache when possible"""
+    vendor = vendor_cache.get(vendor_id)
+    if vendor is None:
+        vendor = await vendors_collection.find_one(
+            {"vendor_id": vendor_id},
+            {"_id": 0, "vendor_id": 1, "name": 1, "upi_id": 1}
+        )
+        if vendor is not None:
+            vendor_cache[vendor_id] = vendor
+    return vendor
+
+def page_filter(query: dict, before: Optional[str]) -> dict:
+    """Restrict a transactions query to documents older than the `before` cursor"""
+    if before is None:
+        return query
+    if not ObjectId.is_valid(before):
+        raise HTTPException(status_code=422, detail="Invalid pagination cursor")
+    return {**query, "_id": {"$lt": ObjectId(before)}}
+
+def parent_from_student(student: Optional[dict]) -> Optional[Parent]:
+    """Build parent information from an already fetched student record"""
     if not student:
         return None
     
@@ -58,11 +129,11 @@ async def get_parent_by_student_id(student_id: str) -> Optional[Parent]:
         name=student.get("parent_name", "Parent")
     )
 
-class ParentUpdate(BaseModel):
+class ParentUpdate(APIModel):
     student_id: str
     phone: str
 
-class OTPVerification(BaseModel):
+class OTPVerification(APIModel):
     phone_number: str
     otp_code: str
     service_sid: str
@@ -71,10 +142,60 @@ class OTPVerification(BaseModel):
 def read_root():
     return {"message": "Smart Card Payment System API"}
 
+def verify_payment_signature(order_id, payment_id, signature) -> bool:
+    """Check a Razorpay checkout signature: HMAC-SHA256 of "order_id|payment_id" keyed with the API secret"""
+    if not RAZORPAY_KEY_SECRET:
+        raise RuntimeError("RAZORPAY_KEY_SECRET is not configured")
+    if not all(isinstance(value, str) and value for value in (order_id, payment_id, signature)):
+        return False
+    expected = hmac.new(
+        RAZORPAY_KEY_SECRET.encode(),
+        f"{order_id}|{payment_id}".encode(),
+        hashlib.sha256
+    ).hexdigest()
+    return hmac.compare_digest(expected.encode(), signature.encode())
+
+# QR images only depend on their payload, so render each one once
+qr_cache = LRUCache(maxsize=4096)
+
+def _render_qr_sync(payload_json: str) -> tuple[str, bytes]:
+    """Render a QR code for the payload as a base64 PNG data URL, plus the URL's SHA-256 digest"""
+    buffer = BytesIO()
+    segno.make(payload_json, error='M').save(buffer, kind='png', scale=5)
+    qr_base64 = base64.b64encode(buffer.getvalue()).decode()
+    data_url = f"data:image/png;base64,{qr_base64}"
+    return data_url, hashlib.sha256(data_url.encode()).digest()
+
+async def render_qr(payload_json: str) -> tuple[str, bytes]:
+    """Get the QR data URL and its digest for a payload, rendering in the threadpool on a cache miss"""
+    rendered = qr_cache.get(payload_json)
+    if rendered is None:
+        rendered = await asyncio.get_running_loop().run_in_executor(None, _render_qr_sync, payload_json)
+        qr_cache[payload_json] = rendered
+    return rendered
+
+def qr_response(request: Request, rendered: tuple[str, bytes], fields: dict) -> Response:
+    """
+    Build a QR endpoint response whose ETag covers the whole body (QR image and
+    the live fields next to it), answering 304 when the client's copy is current
+    """
+    data_url, qr_digest = rendered
+    etag = f'"{hashlib.sha256(qr_digest + orjson.dumps(fields)).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+    if_none_match = request.headers.get("if-none-match", "")
+    client_etags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    if etag in client_etags or "*" in client_etags:
+        return Response(status_code=304, headers=headers)
+    return ORJSONResponse({"qr_code": data_url, **fields}, headers=headers)
+
 # Generate Vendor QR Code
 @app.get("/get_vendor_qr/{vendor_id}")
-async def get_vendor_qr(vendor_id: str):
-    vendor = vendors_collection.find_one({"vendor_id": vendor_id})
+async def get_vendor_qr(vendor_id: str, request: Request):
+    vendor = await vendors_collection.find_one(
+        {"vendor_id": vendor_id},
+        {"_id": 0, "name": 1, "upi_id": 1, "balance": 1}
+    )
     if not vendor:
         raise HTTPException(status_code=404, detail="Vendor not found")
 
@@ -85,30 +206,29 @@ async def get_vendor_qr(vendor_id: str):
         "upi_id": vendor["upi_id"]
     }
     
-    qr_code_data = json.dumps(vendor_data)
-    qr = qrcode.make(qr_code_data)
-    buffer = BytesIO()
-    qr.save(buffer, format="PNG")
-    qr_base64 = base64.b64encode(buffer.getvalue()).decode()
+    qr_code_data = orjson.dumps(vendor_data).decode()
+    rendered = await render_qr(qr_code_data)
 
-    return {
-        "qr_code": f"data:image/png;base64,{qr_base64}",
+    return qr_response(request, rendered, {
         "vendor_name": vendor["name"],
         "upi_id": vendor["upi_id"],
         "balance": vendor.get("balance", 0)
-    }
+    })
 
 # Create Razorpay Order for Wallet Recharge
 @app.post("/create_recharge_order")
-async def create_recharge_order(request: WalletRechargeRequest):
+async def create_recharge_order(request: WalletRechargeRequest, background_tasks: BackgroundTasks):
     try:
-        # Check if student exists
-        student = students_collection.find_one({"student_id": request.student_id})
+        # Check if student exists; parent contact details are read fresh for the SMS below
+        student = await students_collection.find_one(
+            {"student_id": request.student_id},
+            {"_id": 0, "name": 1, "parent_phone": 1, "parent_name": 1}
+        )
         if not student:
             raise HTTPException(status_code=404, detail="Student not found")
 
         # Check if vendor exists
-        vendor = vendors_collection.find_one({"vendor_id": request.vendor_id})
+        vendor = await get_cached_vendor(request.vendor_id)
         if not vendor:
             raise HTTPException(status_code=404, detail="Vendor not found")
 
@@ -129,15 +249,14 @@ async def create_recharge_order(request: WalletRechargeRequest):
         try:
             order = client.order.create(data=order_data)
         except Exception as e:
-            print(f"Razorpay order creation error: {str(e)}")  # Debug log
+            logger.exception("Razorpay order creation error")
             raise HTTPException(
                 status_code=500,
                 detail=f"Failed to create payment order: {str(e)}"
             )
 
         # Create order document with date
-        current_time = datetime.datetime.now()
-        formatted_date = current_time.strftime("%d/%m/%Y, %H:%M:%S")
+        current_time, formatted_date = _stamp()
         
         order_doc = {
             "order_id": order['id'],
@@ -150,10 +269,10 @@ async def create_recharge_order(request: WalletRechargeRequest):
             "formatted_date": formatted_date
         }
         
-        transactions_collection.insert_one(order_doc)
+        await transactions_collection.insert_one(order_doc)
 
-        # Get parent and vendor details for SMS
-        parent = await get_parent_by_student_id(request.student_id)
+        # Get parent details for SMS
+        parent = parent_from_student(student)
 
         if parent and parent.phone:
             message = format_recharge_message(
@@ -161,7 +280,7 @@ async def create_recharge_order(request: WalletRechargeRequest):
                 vendor_name=vendor["name"],
                 student_name=student["name"]
             )
-            send_payment_notification(parent.phone, message)
+            background_tasks.add_task(send_payment_notification, parent.phone, message)
 
         return {
             "id": order['id'],
@@ -172,69 +291,56 @@ async def create_recharge_order(request: WalletRechargeRequest):
     except HTTPException as he:
         raise he
     except Exception as e:
-        print(f"Order creation error: {str(e)}")
+        logger.exception("Order creation error")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 # Verify Razorpay Payment and Update Wallet
 @app.post("/verify_recharge_payment")
-async def verify_recharge_payment(payment: dict):
+async def verify_recharge_payment(payment: dict, background_tasks: BackgroundTasks):
     try:
-        print("Received payment verification request:", payment)
+        logger.debug("Received payment verification request: %s", payment)
         
         # Verify payment signature
-        params_dict = {
-            'razorpay_payment_id': payment.get('razorpay_payment_id'),
-            'razorpay_order_id': payment.get('razorpay_order_id'),
-            'razorpay_signature': payment.get('razorpay_signature')
-        }
-
-        try:
-            client.utility.verify_payment_signature(params_dict)
-            print("Payment signature verified successfully")  # Debug log
-        except Exception as e:
-            print(f"Signature verification failed: {str(e)}")  # Debug log
+        if not verify_payment_signature(
+            payment.get('razorpay_order_id'),
+            payment.get('razorpay_payment_id'),
+            payment.get('razorpay_signature')
+        ):
+            logger.info("Signature verification failed for order %s", payment.get('razorpay_order_id'))
             raise HTTPException(
                 status_code=400,
-                detail=f"Payment verification failed: {str(e)}"
+                detail="Payment verification failed: Razorpay Signature Verification Failed"
             )
+        logger.debug("Payment signature verified successfully")
+
+        order_id = payment['razorpay_order_id']
 
         # Get order details from database
-        order = transactions_collection.find_one({"order_id": payment['razorpay_order_id']})
+        order = await transactions_collection.find_one(
+            {"order_id": order_id},
+            {"_id": 0, "student_id": 1, "vendor_id": 1, "amount": 1, "status": 1, "formatted_date": 1}
+        )
         if not order:
-            print(f"Order not found: {payment['razorpay_order_id']}")  # Debug log
+            logger.info("Order not found: %s", order_id)
             raise HTTPException(status_code=404, detail="Order not found")
+        if order.get("status") != "pending":
+            raise HTTPException(status_code=409, detail="Order already processed")
 
-        print("Found order:", order)  # Debug log
+        logger.debug("Found order: %s", order)
 
-        # Get student and vendor details
-        student = students_collection.find_one({"student_id": payment['student_id']})
-        if not student:
+        # Credit the student and vendor recorded on the order, not whatever the client sent
+        student_id, vendor_id = order["student_id"], order["vendor_id"]
+        student, vendor = await asyncio.gather(get_cached_student(student_id), get_cached_vendor(vendor_id))
+        if student is None:
             raise HTTPException(status_code=404, detail="Student not found")
-
-        vendor = vendors_collection.find_one({"vendor_id": payment['vendor_id']})
-        if not vendor:
+        if vendor is None:
             raise HTTPException(status_code=404, detail="Vendor not found")
 
-        # Update student's wallet balance
-        student_update = students_collection.find_one_and_update(
-            {"student_id": payment['student_id']},
-            {"$inc": {"wallet_balance": order['amount']}},
-            return_document=True
-        )
-
-        # Update vendor's balance
-        vendor_update = vendors_collection.find_one_and_update(
-            {"vendor_id": payment['vendor_id']},
-            {"$inc": {"balance": order['amount']}},
-            return_document=True
-        )
-
-        # Update order status
-        current_time = datetime.datetime.now()
-        formatted_date = current_time.strftime("%d/%m/%Y, %H:%M:%S")
-        
-        transactions_collection.update_one(
-            {"order_id": payment['razorpay_order_id']},
+        # Claim the order; only one request can move it out of pending, so a replayed
+        # signature can't credit the wallet twice
+        current_time, formatted_date = _stamp()
+        claimed = await transactions_collection.find_one_and_update(
+            {"order_id": order_id, "status": "pending"},
             {
                 "$set": {
                     "status": "completed",
@@ -242,25 +348,66 @@ async def verify_recharge_payment(payment: dict):
                     "completed_at": current_time,
                     "formatted_date": formatted_date
                 }
-            }
+            },
+            projection={"_id": 1}
+        )
+        if claimed is None:
+            raise HTTPException(status_code=409, detail="Order already processed")
+
+        student_update, vendor_update = await asyncio.gather(
+            students_collection.find_one_and_update(
+                {"student_id": student_id},
+                {"$inc": {"wallet_balance": order['amount']}},
+                projection={"name": 1, "parent_phone": 1, "parent_name": 1, "wallet_balance": 1},
+                return_document=ReturnDocument.AFTER
+            ),
+            vendors_collection.find_one_and_update(
+                {"vendor_id": vendor_id},
+                {"$inc": {"balance": order['amount']}},
+                projection={"name": 1, "balance": 1},
+                return_document=ReturnDocument.AFTER
+            )
         )
 
+        if not (student_update and vendor_update):
+            # The student or vendor was removed after the checks above: undo the credit
+            # that landed and put the order back to pending
+            if student_update:
+                await students_collection.update_one(
+                    {"student_id": student_id},
+                    {"$inc": {"wallet_balance": -order['amount']}}
+                )
+            if vendor_update:
+                await vendors_collection.update_one(
+                    {"vendor_id": vendor_id},
+                    {"$inc": {"balance": -order['amount']}}
+                )
+            await transactions_collection.update_one(
+                {"order_id": order_id},
+                {
+                    "$set": {"status": "pending", "formatted_date": order.get("formatted_date")},
+                    "$unset": {"payment_id": "", "completed_at": ""}
+                }
+            )
+            detail = "Student not found" if not student_update else "Vendor not found"
+            raise HTTPException(status_code=404, detail=detail)
+
         # Send OTP notification
         try:
-            parent = await get_parent_by_student_id(payment['student_id'])
+            parent = parent_from_student(student_update)
             
             if parent and parent.phone:
                 message = format_recharge_message(
                     amount=order['amount'],
-                    vendor_name=vendor['name'],
-                    student_name=student['name']
+                    vendor_name=vendor_update['name'],
+                    student_name=student_update['name']
                 )
-                print(f"Sending OTP to {parent.phone}")  # Debug log
-                send_payment_notification(parent.phone, message)
+                logger.debug("Queueing OTP to %s", parent.phone)
+                background_tasks.add_task(send_payment_notification, parent.phone, message)
             else:
-                print("No parent phone number found for notification")  # Debug log
-        except Exception as e:
-            print(f"Error sending OTP notification: {str(e)}")  # Debug log
+                logger.debug("No parent phone number found for notification")
+        except Exception:
+            logger.exception("Error sending OTP notification")
 
         return {
             "status": "success",
@@ -271,12 +418,12 @@ async def verify_recharge_payment(payment: dict):
     except HTTPException as he:
         raise he
     except Exception as e:
-        print(f"Payment verification error: {str(e)}")  # Debug log
+        logger.exception("Payment verification error")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/student/{student_id}")
 async def get_student(student_id: str):
-    student = students_collection.find_one({"student_id": student_id})
+    student = await students_collection.find_one({"student_id": student_id})
     if not student:
         raise HTTPException(status_code=404, detail="Student not found")
     
@@ -286,7 +433,10 @@ async def get_student(student_id: str):
 
 @app.get("/vendor/{vendor_id}")
 async def get_vendor(vendor_id: str):
-    vendor = vendors_collection.find_one({"vendor_id": vendor_id})
+    vendor = await vendors_collection.find_one(
+        {"vendor_id": vendor_id},
+        {"_id": 0, "vendor_id": 1, "name": 1, "upi_id": 1, "balance": 1}
+    )
     if not vendor:
         raise HTTPException(status_code=404, detail="Vendor not found")
     return {
@@ -298,104 +448,173 @@ async def get_vendor(vendor_id: str):
 
 # Generate Student QR Code
 @app.get("/get_student_qr/{student_id}")
-async def get_student_qr(student_id: str):
-    student = students_collection.find_one({"student_id": student_id})
+async def get_student_qr(student_id: str, request: Request):
+    # IDs are restricted to characters that need no JSON escaping, see the payload below
+    if not STUDENT_ID_PATTERN.fullmatch(student_id):
+        raise HTTPException(status_code=422, detail="Invalid student ID")
+
+    student = await students_collection.find_one(
+        {"student_id": student_id},
+        {"_id": 0, "name": 1, "balance": 1}
+    )
     if not student:
         raise HTTPException(status_code=404, detail="Student not found")
 
     # Create QR code data with student information
-    qr_data = json.dumps({"student_id": student_id})
-    
-    qr = qrcode.make(qr_data)
-    buffer = BytesIO()
-    qr.save(buffer, format="PNG")
-    qr_base64 = base64.b64encode(buffer.getvalue()).decode()
+    qr_data = f'{{"student_id": "{student_id}"}}'
+    rendered = await render_qr(qr_data)
 
-    return {
-        "qr_code": f"data:image/png;base64,{qr_base64}",
+    return qr_response(request, rendered, {
         "student_name": student["name"],
         "balance": student["balance"]
+    })
+
+# Each debit only matches if the balance covers the amount
+def _debit_student(payment: StudentPaymentRequest, session=None):
+    return students_collection.find_one_and_update(
+        {"student_id": payment.student_id, "balance": {"$gte": payment.amount}},
+        {"$inc": {"balance": -payment.amount}},
+        projection={"_id": 0, "name": 1, "balance": 1, "parent_phone": 1, "parent_name": 1},
+        return_document=ReturnDocument.AFTER,
+        session=session
+    )
+
+def _debit_vendor(payment: StudentPaymentRequest, session=None):
+    return vendors_collection.find_one_and_update(
+        {"vendor_id": payment.vendor_id, "balance": {"$gte": payment.amount}},
+        {"$inc": {"balance": -payment.amount}},
+        projection={"_id": 0, "name": 1, "balance": 1},
+        return_document=ReturnDocument.AFTER,
+        session=session
+    )
+
+def _purchase_record(payment: StudentPaymentRequest, student_update: dict, vendor_update: dict,
+                     current_time: datetime.datetime, formatted_date: str) -> dict:
+    return {
+        "student_id": payment.student_id,
+        "vendor_id": payment.vendor_id,
+        "amount": payment.amount,
+        "type": "purchase",
+        "description": payment.description,
+        "status": "completed",
+        "timestamp": current_time,
+        "formatted_date": formatted_date,
+        "student_balance": student_update["balance"],
+        "vendor_balance": vendor_update["balance"]
     }
 
-# Update the StudentPaymentRequest model to include password
-class StudentPaymentRequest(BaseModel):
-    student_id: str
-    vendor_id: str
-    amount: float
-    description: str = ""
-    password: str  # Added password field
+class _PurchaseRejected(Exception):
+    """Raised inside the purchase transaction to abort it when a debit is rejected"""
+    def __init__(self, student_update: Optional[dict], vendor_update: Optional[dict]):
+        super().__init__("Purchase debit rejected")
+        self.student_update = student_update
+        self.vendor_update = vendor_update
+
+async def purchase_in_transaction(payment: StudentPaymentRequest, current_time: datetime.datetime, formatted_date: str):
+    """
+    Debit both parties and record the purchase in one multi-document transaction
+    (requires a replica set). Returns (student, vendor, transaction); transaction is
+    None if either debit was rejected, in which case nothing is committed.
+    """
+    async def debit_and_record(session):
+        # Operations on one session can't overlap, so these run in sequence
+        student_update = await _debit_student(payment, session)
+        vendor_update = await _debit_vendor(payment, session) if student_update else None
+        if not (student_update and vendor_update):
+            raise _PurchaseRejected(student_update, vendor_update)
+        transaction = _purchase_record(payment, student_update, vendor_update, current_time, formatted_date)
+        await transactions_collection.insert_one(transaction, session=session)
+        return student_update, vendor_update, transaction
+
+    async with await mongo_client.start_session() as session:
+        try:
+            # with_transaction retries write conflicts between concurrent purchases at the
+            # same vendor, as well as unknown commit results
+            return await session.with_transaction(debit_and_record)
+        except _PurchaseRejected as rejected:
+            return rejected.student_update, rejected.vendor_update, None
+
+async def purchase_with_compensation(payment: StudentPaymentRequest, current_time: datetime.datetime, formatted_date: str):
+    """
+    Debit both parties concurrently, then record the purchase. Works on a standalone
+    server; a rejected debit on one side is undone with a reverse $inc on the other.
+    Returns (student, vendor, transaction) like purchase_in_transaction.
+    """
+    student_update, vendor_update = await asyncio.gather(
+        _debit_student(payment),
+        _debit_vendor(payment)
+    )
+    if not (student_update and vendor_update):
+        # Undo whichever debit went through before rejecting the payment
+        if student_update:
+            await students_collection.update_one(
+                {"student_id": payment.student_id},
+                {"$inc": {"balance": payment.amount}}
+            )
+        if vendor_update:
+            await vendors_collection.update_one(
+                {"vendor_id": payment.vendor_id},
+                {"$inc": {"balance": payment.amount}}
+            )
+        return student_update, vendor_update, None
+    transaction = _purchase_record(payment, student_update, vendor_update, current_time, formatted_date)
+    await transactions_collection.insert_one(transaction)
+    return student_update, vendor_update, transaction
 
 @app.post("/process_student_payment")
-async def process_student_payment(payment: StudentPaymentRequest):
+async def process_student_payment(payment: StudentPaymentRequest, background_tasks: BackgroundTasks):
     try:
-        print("Processing payment request:", payment.dict())
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Processing payment request: %s", payment.model_dump(exclude={"password"}))
         
         # Verify student exists and check password
-        student = students_collection.find_one({"student_id": payment.student_id})
-        if not student:
+        student = await students_collection.find_one(
+            {"student_id": payment.student_id},
+            {"_id": 0, "password": 1}
+        )
+        if student is None:
             raise HTTPException(status_code=404, detail="Student not found")
         
-        # Verify student password
-        if payment.password != student.get("password"):
+        # Verify student password; a record without a stored password never authenticates
+        stored_password = student.get("password")
+        if not isinstance(stored_password, str) or not hmac.compare_digest(
+            payment.password.encode("utf-8"),
+            stored_password.encode("utf-8")
+        ):
             raise HTTPException(status_code=401, detail="Invalid student password")
-        
-        # Check balance
-        if student["balance"] < payment.amount:
-            raise HTTPException(status_code=400, detail="Insufficient balance")
 
-        # Verify vendor exists and has sufficient balance
-        vendor = vendors_collection.find_one({"vendor_id": payment.vendor_id})
-        if not vendor:
-            raise HTTPException(status_code=404, detail="Vendor not found")
-            
-        if vendor.get("balance", 0) < payment.amount:
-            raise HTTPException(status_code=400, detail="Insufficient vendor balance")
-
-        # Process the transaction
-        new_student_balance = student["balance"] - payment.amount
-        new_vendor_balance = vendor.get("balance", 0) - payment.amount
-        current_time = datetime.datetime.now()
-        formatted_date = current_time.strftime("%d/%m/%Y, %H:%M:%S")
-        
-        # Update student balance
-        students_collection.update_one(
-            {"student_id": payment.student_id},
-            {"$set": {"balance": new_student_balance}}
-        )
+        current_time, formatted_date = _stamp()
+        if MONGODB_TRANSACTIONS:
+            student_update, vendor_update, transaction = await purchase_in_transaction(
+                payment, current_time, formatted_date
+            )
+        else:
+            student_update, vendor_update, transaction = await purchase_with_compensation(
+                payment, current_time, formatted_date
+            )
 
-        # Update vendor balance
-        vendors_collection.update_one(
-            {"vendor_id": payment.vendor_id},
-            {"$set": {"balance": new_vendor_balance}}
-        )
+        if transaction is None:
+            if not student_update:
+                raise HTTPException(status_code=400, detail="Insufficient balance")
+            if not await vendors_collection.find_one({"vendor_id": payment.vendor_id}, {"_id": 1}):
+                raise HTTPException(status_code=404, detail="Vendor not found")
+            raise HTTPException(status_code=400, detail="Insufficient vendor balance")
 
-        # Record the transaction
-        transaction = {
-            "student_id": payment.student_id,
-            "vendor_id": payment.vendor_id,
-            "amount": payment.amount,
-            "type": "purchase",
-            "description": payment.description,
-            "status": "completed",
-            "timestamp": current_time,
-            "formatted_date": formatted_date,
-            "student_balance": new_student_balance,
-            "vendor_balance": new_vendor_balance
-        }
-        transactions_collection.insert_one(transaction)
+        new_student_balance = student_update["balance"]
+        new_vendor_balance = vendor_update["balance"]
 
         # Send notification to parent
         try:
-            parent = await get_parent_by_student_id(payment.student_id)
+            parent = parent_from_student(student_update)
             if parent and parent.phone:
                 message = format_purchase_message(
                     amount=payment.amount,
-                    vendor_name=vendor["name"],
-                    student_name=student["name"]
+                    vendor_name=vendor_update["name"],
+                    student_name=student_update["name"]
                 )
-                send_payment_notification(parent.phone, message)
-        except Exception as e:
-            print(f"Error sending notification: {str(e)}")
+                background_tasks.add_task(send_payment_notification, parent.phone, message)
+        except Exception:
+            logger.exception("Error sending notification")
 
         return {
             "status": "success",
@@ -409,20 +628,25 @@ async def process_student_payment(payment: StudentPaymentRequest):
     except HTTPException as he:
         raise he
     except Exception as e:
-        print(f"Payment processing error: {str(e)}")
+        logger.exception("Payment processing error")
         raise HTTPException(status_code=500, detail=str(e))
 
 # Get Student Transactions
 @app.get("/student/transactions/{student_id}")
-async def get_student_transactions(student_id: str):
-    student = students_collection.find_one({"student_id": student_id})
+async def get_student_transactions(
+    student_id: str,
+    limit: int = Query(50, ge=1, le=500),
+    before: Optional[str] = None
+):
+    student = await get_cached_student(student_id)
     if not student:
         raise HTTPException(status_code=404, detail="Student not found")
     
-    transactions = list(transactions_collection.find(
-        {"student_id": student_id},
-        sort=[("created_at", -1)]  # Sort by date in descending order
-    ))
+    # Newest first; ObjectIds increase with insertion time
+    transactions = await transactions_collection.find(
+        page_filter({"student_id": student_id}, before),
+        {"amount": 1, "status": 1, "description": 1, "formatted_date": 1, "student_id": 1}
+    ).sort("_id", -1).limit(limit).to_list(length=None)
     
     # Format transactions for display
     formatted_transactions = []
@@ -437,22 +661,32 @@ async def get_student_transactions(student_id: str):
         }
         formatted_transactions.append(formatted_transaction)
     
-    return {"transactions": formatted_transactions}
+    return {
+        "transactions": formatted_transactions,
+        "next_before": formatted_transactions[-1]["_id"] if len(formatted_transactions) == limit else None
+    }
 
 # Get Vendor Transactions
 @app.get("/vendor/transactions/{vendor_id}")
-async def get_vendor_transactions(vendor_id: str):
-    vendor = vendors_collection.find_one({"vendor_id": vendor_id})
-    if not vendor:
+async def get_vendor_transactions(
+    vendor_id: str,
+    limit: int = Query(50, ge=1, le=500),
+    before: Optional[str] = None
+):
+    vendor = await vendors_collection.find_one({"vendor_id": vendor_id}, {"_id": 0, "balance": 1})
+    if vendor is None:
         raise HTTPException(status_code=404, detail="Vendor not found")
     
-    transactions = list(transactions_collection.find({"vendor_id": vendor_id}))
+    transactions = await transactions_collection.find(
+        page_filter({"vendor_id": vendor_id}, before)
+    ).sort("_id", -1).limit(limit).to_list(length=None)
     # Convert ObjectId to string for JSON serialization
     for transaction in transactions:
         transaction["_id"] = str(transaction["_id"])
     
     return {
         "transactions": transactions,
+        "next_before": transactions[-1]["_id"] if len(transactions) == limit else None,
         "current_balance": vendor.get("balance", 0)
     }
 
@@ -461,7 +695,7 @@ async def update_parent_phone(parent_update: ParentUpdate):
     """Update parent's phone number for a given student"""
     try:
         # Find the student and update their parent's phone number
-        result = students_collection.update_one(
+        result = await students_collection.update_one(
             {"student_id": parent_update.student_id},
             {"$set": {"parent_phone": parent_update.phone}}
         )
@@ -485,3 +719,20 @@ async def verify_payment_otp(verification: OTPVerification):
         return {"verified": is_valid}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+
+# Production entry point: `python main.py` starts one process per worker on uvloop/httptools.
+# Equivalent gunicorn command:
+#   gunicorn main:app -k uvicorn.workers.UvicornWorker -w $((2 * $(nproc) + 1))
+# Each worker keeps its own Mongo pool and caches, so total connections scale with workers.
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(
+        "main:app",
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "8000")),
+        workers=int(os.getenv("WEB_CONCURRENCY", (os.cpu_count() or 1) * 2 + 1)),
+        loop="uvloop",
+        http="httptools",
+        log_level="info"
+    )
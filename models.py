@@ -1,30 +1,34 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, ConfigDict
 
-class StudentQRData(BaseModel):
+class APIModel(BaseModel):
+    """Base for request/response models: ignore unknown fields, immutable once parsed"""
+    model_config = ConfigDict(extra='ignore', frozen=True)
+
+class StudentQRData(APIModel):
     student_id: str
 
-class PaymentRequest(BaseModel):
+class PaymentRequest(APIModel):
     vendor_id: str
     amount: float
 
-class WalletRechargeRequest(BaseModel):
+class WalletRechargeRequest(APIModel):
     student_id: str
     vendor_id: str
     amount: float
 
-class VerifyPayment(BaseModel):
+class VerifyPayment(APIModel):
     order_id: str
     razorpay_payment_id: str
     razorpay_signature: str
 
-class StudentPaymentRequest(BaseModel):
+class StudentPaymentRequest(APIModel):
     student_id: str
     vendor_id: str
     amount: float
-    description: Optional[str] = None
+    description: str = ""
+    password: str
 
-class VendorResponse(BaseModel):
+class VendorResponse(APIModel):
     vendor_id: str
     name: str
     upi_id: str
@@ -1,7 +1,14 @@
-from database import students_collection, vendors_collection, transactions_collection
 from pymongo import MongoClient
 from config import MONGODB_URL, DATABASE_NAME
 
+# Seeding runs as a one-off script, so it uses a synchronous client
+# rather than the Motor client the API shares in database.py
+client = MongoClient(MONGODB_URL)
+db = client[DATABASE_NAME]
+students_collection = db["students"]
+vendors_collection = db["vendors"]
+transactions_collection = db["transactions"]
+
 def clear_collections():
     students_collection.delete_many({})
     vendors_collection.delete_many({})
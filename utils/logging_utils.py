@@ -0,0 +1,53 @@
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+_listener = None
+_queue_handler = None
+
+def setup_logging(level="INFO"):
+    """
+    Route the "cards" loggers through a queue so the final formatting and stream
+    writes happen on the listener's background thread instead of the request path.
+    Message interpolation (and traceback text for logger.exception) still runs on
+    the calling thread when the record is queued.
+    Args:
+        level (str): Log level name for the "cards" logger
+    Returns:
+        QueueListener: Started listener. Calling again while it is running returns
+        the same listener; call teardown_logging() on shutdown.
+    """
+    global _listener, _queue_handler
+    if _listener is not None:
+        return _listener
+
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    logger = logging.getLogger("cards")
+    logger.setLevel(level.upper())
+    _queue_handler = QueueHandler(log_queue)
+    logger.addHandler(_queue_handler)
+    logger.propagate = False
+
+    _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+def teardown_logging():
+    """
+    Flush and stop the listener started by setup_logging() and detach its queue
+    handler, so records aren't queued with nobody reading them. Safe to call more
+    than once; setup_logging() can start logging again afterwards.
+    """
+    global _listener, _queue_handler
+    if _listener is None:
+        return
+
+    logger = logging.getLogger("cards")
+    logger.removeHandler(_queue_handler)
+    logger.propagate = True
+    _listener.stop()
+    _listener = None
+    _queue_handler = None
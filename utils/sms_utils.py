@@ -1,5 +1,14 @@
+import logging
+from functools import lru_cache
 from twilio.rest import Client
-from config import TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN
+from config import TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, TWILIO_SERVICE_SID
+
+logger = logging.getLogger("cards.sms")
+
+@lru_cache(maxsize=None)
+def get_twilio_client():
+    """Create the Twilio client once and reuse it (and its HTTP session) for every call"""
+    return Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
 
 def send_payment_notification(phone_number, message):
     """
@@ -9,28 +18,18 @@ def send_payment_notification(phone_number, message):
         message (str): Message content
     """
     try:
-        print(f"Initializing Twilio client with SID: {TWILIO_ACCOUNT_SID}")  # Debug log
-        client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-        
-        print(f"Sending verification to {phone_number}")  # Debug log
-        verification = client.verify.v2.services \
-            .create(
-                friendly_name='Smart Card Payment System'
-            )
-        
-        # Store the service SID for verification
-        service_sid = verification.sid
+        client = get_twilio_client()
         
-        # Send the verification
-        verification = client.verify.v2.services(service_sid) \
+        logger.debug("Sending verification to %s", phone_number)
+        # Send the verification through the configured Verify service
+        verification = client.verify.v2.services(TWILIO_SERVICE_SID) \
             .verifications \
             .create(to=phone_number, channel='sms')
             
-        print(f"Verification sent successfully! Status: {verification.status}")  # Debug log
+        logger.debug("Verification sent successfully! Status: %s", verification.status)
         return True
-    except Exception as e:
-        print(f"Error sending verification: {str(e)}")  # Debug log
-        print(f"Twilio credentials - SID: {TWILIO_ACCOUNT_SID}")  # Debug log
+    except Exception:
+        logger.exception("Error sending verification (Twilio account SID: %s)", TWILIO_ACCOUNT_SID)
         return False
 
 def verify_otp(phone_number, otp_code, service_sid):
@@ -42,24 +41,24 @@ def verify_otp(phone_number, otp_code, service_sid):
         service_sid (str): Twilio Verify Service SID
     """
     try:
-        client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+        client = get_twilio_client()
         verification_check = client.verify.v2.services(service_sid) \
             .verification_checks \
             .create(to=phone_number, code=otp_code)
             
         return verification_check.status == 'approved'
-    except Exception as e:
-        print(f"Error verifying OTP: {str(e)}")
+    except Exception:
+        logger.exception("Error verifying OTP")
         return False
 
 def format_recharge_message(amount, vendor_name, student_name):
     """Format message for recharge notification"""
     message = f"Payment Alert: ₹{amount} recharged to {vendor_name} for student {student_name}."
-    print(f"Formatted recharge message: {message}")  # Debug log
+    logger.debug("Formatted recharge message: %s", message)
     return message
 
 def format_purchase_message(amount, vendor_name, student_name):
     """Format message for purchase notification"""
     message = f"Payment Alert: Your child {student_name} made a purchase of ₹{amount} at {vendor_name}."
-    print(f"Formatted purchase message: {message}")  # Debug log
+    logger.debug("Formatted purchase message: %s", message)
     return message 
\ No newline at end of file